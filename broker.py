@@ -1,6 +1,141 @@
 import asyncio
 import json
-from datetime import datetime
+import logging
+from functools import lru_cache
+
+# orjson is optional; compact stdlib json is the fallback
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+    # Frames arrive as memoryview slices, which stdlib json cannot parse
+    def _loads(data):
+        return json.loads(bytes(data))
+
+log = logging.getLogger('broker')
+
+def _encode_message(topic, payload, sender_id):
+    return _dumps({
+        'topic': topic,
+        'payload': payload,
+        'sender': sender_id
+    })
+
+# Game phases re-send the same tap commands, so reuse their encoded frames.
+# Only used for string payloads: as cache keys 1, 1.0 and True collide.
+@lru_cache(maxsize=256)
+def _encode_cached(topic, payload, sender_id):
+    return _encode_message(topic, payload, sender_id)
+
+# Longest newline-terminated message a client may send
+MAX_MESSAGE_SIZE = 64 * 1024
+
+# Messages a client may have queued before its socket reads are paused
+MAX_QUEUED_MESSAGES = 64
+
+# Reads a client's messages straight into one reusable buffer and parses each
+# complete line in place; also stands in for the StreamWriter on the send side
+class BrokerProtocol(asyncio.BufferedProtocol):
+    def __init__(self, broker):
+        self.broker = broker
+        self.transport = None
+        self._buffer = bytearray(MAX_MESSAGE_SIZE)
+        self._view = memoryview(self._buffer)
+        self._nbytes = 0
+        self._messages = asyncio.Queue()
+        self._reading_paused = False
+        self._writing_paused = False
+        self._drain_waiters = []
+        self._task = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._task = asyncio.get_running_loop().create_task(
+            self.broker.handle_client(self)
+        )
+
+    def get_buffer(self, sizehint):
+        return self._view[self._nbytes:]
+
+    def buffer_updated(self, nbytes):
+        # Only the newly received bytes can hold the next newline
+        search = self._nbytes
+        end = self._nbytes = self._nbytes + nbytes
+        start = 0
+
+        newline = self._buffer.find(b'\n', search, end)
+        while newline != -1:
+            if newline > start:
+                try:
+                    self._messages.put_nowait(_loads(self._view[start:newline]))
+                except ValueError as e:
+                    self._fail(e)
+                    return
+            start = newline + 1
+            newline = self._buffer.find(b'\n', start, end)
+
+        if start:
+            remaining = end - start
+            self._buffer[:remaining] = self._buffer[start:end]
+            self._nbytes = remaining
+        elif end == len(self._buffer):
+            self._fail(ValueError(f"message over {MAX_MESSAGE_SIZE} bytes"))
+            return
+
+        if self._messages.qsize() >= MAX_QUEUED_MESSAGES and not self._reading_paused:
+            self._reading_paused = True
+            self.transport.pause_reading()
+
+    # Hand the error to handle_client and stop reading from this client
+    def _fail(self, exc):
+        self._messages.put_nowait(exc)
+        self.transport.close()
+
+    def connection_lost(self, exc):
+        self._messages.put_nowait(None)
+        for waiter in self._drain_waiters:
+            if not waiter.done():
+                waiter.set_exception(ConnectionResetError('Connection lost'))
+        self._drain_waiters.clear()
+
+    def pause_writing(self):
+        self._writing_paused = True
+
+    def resume_writing(self):
+        self._writing_paused = False
+        for waiter in self._drain_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._drain_waiters.clear()
+
+    # Next parsed message, None once the client is gone
+    async def read_message(self):
+        message = await self._messages.get()
+        if self._reading_paused and self._messages.qsize() <= MAX_QUEUED_MESSAGES // 2:
+            self._reading_paused = False
+            self.transport.resume_reading()
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    def writelines(self, data):
+        self.transport.writelines(data)
+
+    async def drain(self):
+        if self.transport.is_closing():
+            raise ConnectionResetError('Connection lost')
+        if self._writing_paused:
+            waiter = asyncio.get_running_loop().create_future()
+            self._drain_waiters.append(waiter)
+            await waiter
+
+    def close(self):
+        self.transport.close()
 
 # Basic mqtt broker to broadcast messages to wristbands from client
 class Broker:
@@ -9,66 +144,87 @@ class Broker:
         self.port = port
         self.clients = {}
         self.subscriptions = {}
+        self.client_topics = {}
         
-    async def handle_client(self, reader, writer):
-        address = writer.get_extra_info('peername')
+    async def handle_client(self, connection):
+        address = connection.transport.get_extra_info('peername')
         client_id = f"client_{address[1]}"
-        self.clients[client_id] = {'reader': reader, 'writer': writer}
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] New client connected: {client_id}")
+        client = self.clients[client_id] = {
+            'writer': connection,
+            'lock': asyncio.Lock()
+        }
+        log.info("New client connected: %s", client_id)
         
         try:
             while True:
-                data = await reader.read(1024)
-                if not data:
+                # One message per newline-terminated line
+                message = await connection.read_message()
+                if message is None:
                     break
-                    
-                message = json.loads(data.decode())
                 
                 if message['type'] == 'subscribe':
                     topic = message['topic']
-                    if topic not in self.subscriptions:
-                        self.subscriptions[topic] = set()
-                    self.subscriptions[topic].add(client_id)
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] {client_id} subscribed to '{topic}'")
+                    # Subscribers map straight to their client record for routing
+                    self.subscriptions.setdefault(topic, {})[client_id] = client
+                    self.client_topics.setdefault(client_id, set()).add(topic)
+                    log.info("%s subscribed to '%s'", client_id, topic)
                     
                 elif message['type'] == 'publish':
                     topic = message['topic']
                     payload = message['payload']
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] Publishing to '{topic}': {payload}")
+                    # Per-publish logging is the hot path, so it is DEBUG only
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug("Publishing to '%s': %s", topic, payload)
                     await self.publish(topic, payload, client_id)
                     
         except Exception as e:
-            print(f"Error with {client_id}: {e}")
+            log.warning("Error with %s: %s", client_id, e)
         finally:
             del self.clients[client_id]
-            for topic in self.subscriptions:
-                self.subscriptions[topic].discard(client_id)
-            writer.close()
-            await writer.wait_closed()
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] Client disconnected: {client_id}")
+            for topic in self.client_topics.pop(client_id, ()):
+                subscribers = self.subscriptions[topic]
+                subscribers.pop(client_id, None)
+                if not subscribers:
+                    del self.subscriptions[topic]
+            connection.close()
+            log.info("Client disconnected: %s", client_id)
     
     async def publish(self, topic, payload, sender_id):
         if topic in self.subscriptions:
-            message = json.dumps({
-                'topic': topic,
-                'payload': payload,
-                'sender': sender_id
-            }).encode()
-            
-            for client_id in self.subscriptions[topic]:
-                if client_id in self.clients:
-                    writer = self.clients[client_id]['writer']
-                    writer.write(message + b'\n')
-                    await writer.drain()
+            if isinstance(payload, str):
+                message = _encode_cached(topic, payload, sender_id)
+            else:
+                message = _encode_message(topic, payload, sender_id)
+            clients = [
+                client
+                for client_id, client in self.subscriptions[topic].items()
+                if client_id != sender_id
+            ]
+            # Send to every subscriber concurrently rather than one drain at a time
+            await asyncio.gather(
+                *(self._send(client, message) for client in clients),
+                return_exceptions=True
+            )
+
+    # Concurrent drain() calls on one writer are not safe, so serialize them
+    async def _send(self, client, message):
+        async with client['lock']:
+            writer = client['writer']
+            writer.writelines((message, b'\n'))
+            await writer.drain()
     
     async def start(self):
-        server = await asyncio.start_server(
-            self.handle_client, self.host, self.port
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(
+            lambda: BrokerProtocol(self), self.host, self.port
         )
-        print(f"MQTT Broker running on {self.host}:{self.port}")
+        log.info("MQTT Broker running on %s:%s", self.host, self.port)
         async with server:
             await server.serve_forever()
 
 if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO, format='[%(asctime)s] %(message)s', datefmt='%H:%M:%S'
+    )
     broker = Broker()
     asyncio.run(broker.start())
\ No newline at end of file
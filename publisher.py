@@ -2,9 +2,13 @@ import asyncio
 import json
 import random
 import argparse
+import os
+import queue
+import sys
+import threading
 from enum import Enum, auto
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import Awaitable, Callable, Optional
 from pathlib import Path
 import pygame
 
@@ -35,6 +39,17 @@ class GameState:
     phase: Phase = Phase.DAY
     pending_kill_id: Optional[int] = None
     pending_save_id: Optional[int] = None
+    # Alive player ids per role, kept in step with Player.alive
+    alive_by_role: dict = field(default_factory=dict)
+
+    def kill(self, player: Player) -> None:
+        player.alive = False
+        self.alive_by_role[player.role].discard(player.id)
+
+    def alive_ids(self) -> list:
+        return sorted(
+            player_id for ids in self.alive_by_role.values() for player_id in ids
+        )
 
 # Handle earcons
 class SoundManager:
@@ -54,6 +69,7 @@ class SoundManager:
         self.sound_dir = Path(sound_dir).resolve()
         self.enabled = enabled
         self._sounds_cache = {}
+        self._requests = queue.Queue()
         
         if self.enabled:
             # Initialize mixer with specific settings for better compatibility
@@ -61,6 +77,8 @@ class SoundManager:
             pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=512)
             self._preload_sounds()
 
+        threading.Thread(target=self._audio_loop, daemon=True).start()
+
     def _preload_sounds(self) -> None:
         print(f"Loading sounds from: {self.sound_dir}")
         for key, filename in self.SOUND_FILES.items():
@@ -73,7 +91,26 @@ class SoundManager:
             else:
                 print(f"Not found: {path}")
 
-    def play(self, sound_key: str) -> None:
+    # Mixer calls run on this thread so they never stall the event loop
+    def _audio_loop(self) -> None:
+        while True:
+            sound, loop, done = self._requests.get()
+            try:
+                channel = sound.play()
+                if channel:
+                    while channel.get_busy():
+                        pygame.time.wait(50)
+            except Exception as e:
+                print(f"  [Sound error: {e}]")
+            loop.call_soon_threadsafe(self._finish, done)
+
+    @staticmethod
+    def _finish(done: asyncio.Future) -> None:
+        if not done.done():
+            done.set_result(None)
+
+    # Hands the earcon to the audio thread and waits until it has finished
+    async def play(self, sound_key: str) -> None:
         if not self.enabled:
             return
 
@@ -82,17 +119,14 @@ class SoundManager:
             print(f"  [Sound not loaded: {sound_key}]")
             return
 
-        try:
-            channel = sound.play()
-            if channel:
-                while channel.get_busy():
-                    pygame.time.wait(50)
-        except Exception as e:
-            print(f"  [Sound error: {e}]")
-
-    def play_sequence(self, *sound_keys: str) -> None:
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        self._requests.put((sound, loop, done))
+        await done
+
+    async def play_sequence(self, *sound_keys: str) -> None:
         for key in sound_keys:
-            self.play(key)
+            await self.play(key)
 
 # Sends tap commands to the broker for the wristbands
 class TapManager:
@@ -103,46 +137,102 @@ class TapManager:
         Role.DETECTIVE: 4,
     }
 
-    def __init__(self, writer, topic: str, enabled: bool = True):
+    def __init__(self, writer, topic: str, enabled: bool = True,
+                 ensure_connected: Optional[Callable[[], Awaitable]] = None):
         self.writer = writer
         self.topic = topic
         self.enabled = enabled
+        self.ensure_connected = ensure_connected
+        self._lock = asyncio.Lock()
+
+        # Only the id and tap count vary, so encode the envelope once up front
+        self._frame_tmpl = (json.dumps({
+            "type": "publish",
+            "topic": self.topic.replace("%", "%%"),
+            "payload": '{"id": %d, "taps": %d}'
+        }) + "\n").encode()
+        self._frame_cache = {}
+
+    def _encode(self, player_id: int, taps: int) -> bytes:
+        key = (player_id, taps)
+        frame = self._frame_cache.get(key)
+        if frame is None:
+            frame = self._frame_cache[key] = self._frame_tmpl % key
+        return frame
+
+    # Game phases can overlap, so guard write + drain against concurrent use
+    # Returns False if the broker could not be reached and nothing was sent
+    async def _write(self, frames: list) -> bool:
+        async with self._lock:
+            try:
+                # One connection is reused for the whole game, redialed only if it drops
+                if self.ensure_connected is not None:
+                    self.writer = await self.ensure_connected()
+                try:
+                    self.writer.writelines(frames)
+                    await self.writer.drain()
+                except ConnectionError:
+                    if self.ensure_connected is None:
+                        raise
+                    self.writer = await self.ensure_connected()
+                    self.writer.writelines(frames)
+                    await self.writer.drain()
+            except OSError as e:
+                if self.ensure_connected is None:
+                    raise
+                print(f"Broker unreachable, taps not sent: {e}")
+                return False
+        return True
 
     # Send taps to some wristband
     async def send(self, player_id: int, taps: int) -> None:
         if not self.enabled:
             return
 
-        payload = json.dumps({"id": player_id, "taps": taps})
+        if await self._write([self._encode(player_id, taps)]):
+            print(f"Sent {taps} tap(s) to wristband {player_id}")
+
+    # Send taps to several wristbands in a single write
+    async def send_batch(self, items: list) -> None:
+        if not self.enabled or not items:
+            return
+
+        if not await self._write([
+            self._encode(player_id, taps) for player_id, taps in items
+        ]):
+            return
+        for player_id, taps in items:
+            print(f"Sent {taps} tap(s) to wristband {player_id}")
+
+    # Send taps to several wristbands as one publish with a list payload
+    async def send_combined(self, items: list) -> None:
+        if not self.enabled or not items:
+            return
+
+        payload = json.dumps([
+            {"id": player_id, "taps": taps} for player_id, taps in items
+        ])
         message = json.dumps({
             "type": "publish",
             "topic": self.topic,
             "payload": payload
         })
-        self.writer.write(message.encode())
-        await self.writer.drain()
-        print(f"Sent {taps} tap(s) to wristband {player_id}")
-
-    # For communicating with some role
-    async def send_to_role(self, players: dict, role: Role, taps: int) -> None:
-        for player in players.values():
-            if player.alive and player.role == role:
-                await self.send(player.id, taps)
+        if not await self._write([message.encode() + b"\n"]):
+            return
+        for player_id, taps in items:
+            print(f"Sent {taps} tap(s) to wristband {player_id}")
 
-    # All alive players
-    async def send_to_all_alive(self, players: dict, taps: int) -> None:
-        for player in players.values():
-            if player.alive:
-                await self.send(player.id, taps)
-                await asyncio.sleep(0.1)
+    # Same taps for a group of wristbands, e.g. one role or everyone alive
+    async def send_to_players(self, player_ids, taps: int) -> None:
+        await self.send_batch([(player_id, taps) for player_id in player_ids])
 
     # Initial role distribution taps
     async def distribute_roles(self, players: dict) -> None:
         print("\nDistributing roles via taps...")
-        for player in players.values():
-            taps = self.ROLE_TAPS[player.role]
-            await self.send(player.id, taps)
-            await asyncio.sleep(0.8)
+        await self.send_combined([
+            (player.id, self.ROLE_TAPS[player.role])
+            for player in players.values()
+        ])
 
 # Game controller
 class MafiaGame:
@@ -160,6 +250,23 @@ class MafiaGame:
         self.taps: Optional[TapManager] = None
         self.writer = None
         self.reader = None
+        self._connected = False
+        self._reader_task: Optional[asyncio.Task] = None
+        self._commands: Optional[asyncio.Queue] = None
+        self._stdin_buffer = b""
+
+        # command -> (handler, min args, max args, index of int arg, usage)
+        self._dispatch = {
+            "next": (self.next_phase, 0, 0, None, "next"),
+            "kill": (self.kill_player, 1, 1, 0, "kill <player_id>"),
+            "save": (self.save_player, 1, 1, 0, "save <player_id>"),
+            "check": (self.check_player, 1, 1, 0, "check <player_id>"),
+            "repeat": (self.repeat_roles, 0, 1, 0, "repeat [player_id]"),
+            "tap": (self.tap_players, 1, None, None,
+                    "tap <player_id> <taps>[; <player_id> <taps> ...]"),
+            "reset": (self.reset_game, 0, 0, None, "reset"),
+            "switch": (self.switch_mode, 1, 1, None, "switch <taps|sounds|all>"),
+        }
 
     # Randomize wristband roles
     def _initialize_players(self) -> None:
@@ -170,6 +277,9 @@ class MafiaGame:
             i: Player(id=i, role=roles[i - 1])
             for i in range(1, self.PLAYER_COUNT + 1)
         }
+        self.state.alive_by_role = {role: set() for role in Role}
+        for player in self.state.players.values():
+            self.state.alive_by_role[player.role].add(player.id)
         self.state.phase = Phase.DAY
         
         # Potential actions
@@ -181,8 +291,8 @@ class MafiaGame:
             print(f"Wristband {player.id}: {player.role.value.upper()}")
         print("=" * 40 + "\n")
 
-    # Connect game object to MQTT broker
-    async def _connect(self) -> None:
+    # Open the broker connection and subscribe to the game topic
+    async def _open_connection(self):
         self.reader, self.writer = await asyncio.open_connection(
             self.host, self.port
         )
@@ -191,14 +301,42 @@ class MafiaGame:
             "type": "subscribe",
             "topic": self.TOPIC
         })
-        self.writer.write(subscribe_msg.encode())
+        self.writer.write(subscribe_msg.encode() + b"\n")
         await self.writer.drain()
 
+        self._connected = True
+        self._reader_task = asyncio.create_task(self._watch_reader(self.reader))
+        return self.writer
+
+    # Nothing else reads from the broker, so drain it here to notice when it goes away
+    async def _watch_reader(self, reader) -> None:
+        try:
+            while await reader.read(4096):
+                pass
+        except OSError:
+            pass
+        if reader is self.reader:
+            self._connected = False
+
+    # Returns the broker writer, redialing first if the broker dropped us
+    async def _ensure_connected(self):
+        if not self._connected or self.writer.is_closing():
+            print("Lost connection to broker, reconnecting...")
+            self.writer.close()
+            await self._open_connection()
+            print(f"Reconnected to broker at {self.host}:{self.port}")
+        return self.writer
+
+    # Connect game object to MQTT broker
+    async def _connect(self) -> None:
+        await self._open_connection()
+
         taps_enabled = not self.only_sound
         sound_enabled = not self.only_taps
 
         self.sound = SoundManager(enabled=sound_enabled)
-        self.taps = TapManager(self.writer, self.TOPIC, enabled=taps_enabled)
+        self.taps = TapManager(self.writer, self.TOPIC, enabled=taps_enabled,
+                               ensure_connected=self._ensure_connected)
 
         print(f"Connected to broker at {self.host}:{self.port}")
 
@@ -214,7 +352,7 @@ class MafiaGame:
 
     # Returns the alive status of a role
     def _is_role_alive(self, role: Role) -> bool:
-        return any(p.alive and p.role == role for p in self.state.players.values())
+        return bool(self.state.alive_by_role[role])
 
     # Phases
     async def _wake_everyone(self) -> None:
@@ -222,8 +360,8 @@ class MafiaGame:
         self.state.phase = Phase.DAY
         print("\nDaytime")
 
-        self.sound.play_sequence("wake", "everyone")
-        await self.taps.send_to_all_alive(self.state.players, 2)
+        await self.sound.play_sequence("wake", "everyone")
+        await self.taps.send_to_players(self.state.alive_ids(), 2)
 
     async def _start_night(self) -> None:
         """Begin night phase - everyone sleeps, then mafia wakes."""
@@ -231,8 +369,8 @@ class MafiaGame:
         self.state.pending_save_id = None
 
         print("\nNight phase")
-        self.sound.play_sequence("sleep", "everyone")
-        await self.taps.send_to_all_alive(self.state.players, 2)
+        await self.sound.play_sequence("sleep", "everyone")
+        await self.taps.send_to_players(self.state.alive_ids(), 2)
 
         await asyncio.sleep(0.5)
         await self._wake_mafia()
@@ -241,13 +379,13 @@ class MafiaGame:
     async def _wake_mafia(self) -> None:
         self.state.phase = Phase.NIGHT_MAFIA
         print("\nMafia wakes up")
-        self.sound.play_sequence("wake", "mafia")
-        await self.taps.send_to_role(self.state.players, Role.MAFIA, 2)
+        await self.sound.play_sequence("wake", "mafia")
+        await self.taps.send_to_players(self.state.alive_by_role[Role.MAFIA], 2)
 
     async def _sleep_and_wake_doctor(self) -> None:
         if self._is_role_alive(Role.MAFIA):
             print("Mafia goes to sleep")
-            self.sound.play_sequence("sleep", "mafia")
+            await self.sound.play_sequence("sleep", "mafia")
             await asyncio.sleep(0.3)
 
         self.state.phase = Phase.NIGHT_DOCTOR
@@ -258,15 +396,15 @@ class MafiaGame:
             return
 
         print("\nDoctor wakes up.")
-        self.sound.play_sequence("wake", "doctor")
-        await self.taps.send_to_role(self.state.players, Role.DOCTOR, 2)
+        await self.sound.play_sequence("wake", "doctor")
+        await self.taps.send_to_players(self.state.alive_by_role[Role.DOCTOR], 2)
 
         print("Use 'save X' to protect someone, then 'next'.")
 
     async def _sleep_and_wake_detective(self) -> None:
         if self._is_role_alive(Role.DOCTOR):
             print("\nDoctor goes to sleep.")
-            self.sound.play_sequence("sleep", "doctor")
+            await self.sound.play_sequence("sleep", "doctor")
             await asyncio.sleep(0.3)
 
         self.state.phase = Phase.NIGHT_DETECTIVE
@@ -277,13 +415,13 @@ class MafiaGame:
             return
 
         print("\nDetective wakes up.")
-        self.sound.play_sequence("wake", "detective")
-        await self.taps.send_to_role(self.state.players, Role.DETECTIVE, 2)
+        await self.sound.play_sequence("wake", "detective")
+        await self.taps.send_to_players(self.state.alive_by_role[Role.DETECTIVE], 2)
 
     async def _end_night(self) -> None:
         if self._is_role_alive(Role.DETECTIVE):
             print("\nDetective goes to sleep.")
-            self.sound.play_sequence("sleep", "detective")
+            await self.sound.play_sequence("sleep", "detective")
             await asyncio.sleep(0.3)
 
         # Resolve kill/save
@@ -293,11 +431,11 @@ class MafiaGame:
             if victim and victim.alive:
                 if self.state.pending_save_id == self.state.pending_kill_id:
                     print(f"\nPlayer {victim.id} was saved by the doctor.")
-                    self.sound.play("protection")
+                    await self.sound.play("protection")
                 else:
-                    victim.alive = False
+                    self.state.kill(victim)
                     print(f"\nPlayer {victim.id} ({victim.role.value}) was killed.")
-                    self.sound.play_sequence("lynch", "everyone")
+                    await self.sound.play_sequence("lynch", "everyone")
                     await self.taps.send(victim.id, 1)
 
         self.state.pending_kill_id = None
@@ -333,22 +471,22 @@ class MafiaGame:
             self.state.pending_kill_id = player_id
             print(f"Mafia targets player {player_id}.")
             # Send sleep taps to mafia
-            await self.taps.send_to_role(self.state.players, Role.MAFIA, 2)
+            await self.taps.send_to_players(self.state.alive_by_role[Role.MAFIA], 2)
             # Advance to doctor
             await self.next_phase()
 
     async def _lynch(self, target: Player) -> None:
-        target.alive = False
+        self.state.kill(target)
         print(f"\nPlayer {target.id} has been lynched.")
 
-        self.sound.play("lynch")
+        await self.sound.play("lynch")
 
         if target.role == Role.MAFIA:
             print(f"They were the mafia!")
-            self.sound.play("mafia")
+            await self.sound.play("mafia")
         else:
             print(f"   They were the {target.role.value}.")
-            self.sound.play("everyone")
+            await self.sound.play("everyone")
 
         self._check_win_condition()
 
@@ -365,7 +503,7 @@ class MafiaGame:
         self.state.pending_save_id = player_id
         print(f"Doctor will protect player {player_id}.")
         # Send sleep taps to doctor
-        await self.taps.send_to_role(self.state.players, Role.DOCTOR, 2)
+        await self.taps.send_to_players(self.state.alive_by_role[Role.DOCTOR], 2)
         # Auto-advance to detective
         await self.next_phase()
 
@@ -379,25 +517,22 @@ class MafiaGame:
             print(f"Player {player_id} is not a valid target.")
             return
 
-        self.sound.play("hint")
+        await self.sound.play("hint")
 
         is_mafia = target.role == Role.MAFIA
         result = "Mafia." if is_mafia else f"not mafia ({target.role.value})"
         print(f"Player {player_id} is {result}")
         # Send sleep taps to detective
-        await self.taps.send_to_role(self.state.players, Role.DETECTIVE, 2)
+        await self.taps.send_to_players(self.state.alive_by_role[Role.DETECTIVE], 2)
         # Auto-advance to end night
         await self.next_phase()
 
     # Game state
     def _check_win_condition(self) -> None:
-        mafia_alive = sum(
-            1 for p in self.state.players.values()
-            if p.alive and p.role == Role.MAFIA
-        )
+        mafia_alive = len(self.state.alive_by_role[Role.MAFIA])
         town_alive = sum(
-            1 for p in self.state.players.values()
-            if p.alive and p.role != Role.MAFIA
+            len(ids) for role, ids in self.state.alive_by_role.items()
+            if role != Role.MAFIA
         )
 
         if mafia_alive == 0:
@@ -419,6 +554,24 @@ class MafiaGame:
             print("Repeating roles to all players...")
             await self.taps.distribute_roles(self.state.players)
 
+    # Send raw taps, e.g. "1 2; 3 4" taps wristband 1 twice and 3 four times
+    async def tap_players(self, spec: str) -> None:
+        items = []
+        for chunk in spec.split(";"):
+            fields = chunk.split()
+            if not fields:
+                continue
+            if len(fields) != 2 or not all(f.isdigit() for f in fields):
+                items = []
+                break
+            items.append((int(fields[0]), int(fields[1])))
+
+        if not items:
+            print("Usage: tap <player_id> <taps>[; <player_id> <taps> ...]")
+            return
+
+        await self.taps.send_combined(items)
+
     # Switch between game modes
     async def switch_mode(self, mode: str) -> None:
         if mode == "taps":
@@ -459,44 +612,72 @@ class MafiaGame:
         if not parts:
             return True
 
-        command = parts[0]
+        command, args = parts[0], parts[1:]
 
         if command == "quit":
             return False
-        elif command == "next":
-            await self.next_phase()
-        elif command == "kill" and len(parts) >= 2:
-            try:
-                await self.kill_player(int(parts[1]))
-            except ValueError:
-                print("Usage: kill <player_id>")
-        elif command == "save" and len(parts) >= 2:
-            try:
-                await self.save_player(int(parts[1]))
-            except ValueError:
-                print("Usage: save <player_id>")
-        elif command == "check" and len(parts) >= 2:
+
+        entry = self._dispatch.get(command)
+        if entry is None:
+            print(f"Unknown command: {command}. Type 'help' for commands.")
+            return True
+
+        handler, min_args, max_args, int_arg, usage = entry
+        if len(args) < min_args:
+            print(f"Usage: {usage}")
+            return True
+
+        # max_args of None passes the rest of the line as one argument
+        if max_args is None:
+            args = [" ".join(args)] if args else []
+        else:
+            args = args[:max_args]
+
+        if int_arg is not None and int_arg < len(args):
             try:
-                await self.check_player(int(parts[1]))
+                args[int_arg] = int(args[int_arg])
             except ValueError:
-                print("Usage: check <player_id>")
-        elif command == "repeat":
-            if len(parts) >= 2:
-                try:
-                    await self.repeat_roles(int(parts[1]))
-                except ValueError:
-                    print("Usage: repeat [player_id]")
-            else:
-                await self.repeat_roles()
-        elif command == "reset":
-            await self.reset_game()
-        elif command == "switch" and len(parts) >= 2:
-            await self.switch_mode(parts[1])
-        else:
-            print(f"Unknown command: {command}. Type 'help' for commands.")
+                print(f"Usage: {usage}")
+                return True
 
+        await handler(*args)
         return True
 
+    # Read commands on the event loop itself; falls back to a thread where the
+    # loop cannot watch stdin (Windows, or stdin redirected from a file)
+    def _watch_stdin(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._commands = asyncio.Queue()
+        try:
+            loop.add_reader(sys.stdin.fileno(), self._on_stdin)
+        except (NotImplementedError, OSError):
+            self._commands = None
+
+    def _on_stdin(self) -> None:
+        data = os.read(sys.stdin.fileno(), 4096)
+        if not data:
+            asyncio.get_running_loop().remove_reader(sys.stdin.fileno())
+            if self._stdin_buffer:
+                self._commands.put_nowait(self._stdin_buffer.decode(errors="replace"))
+            self._commands.put_nowait(None)
+            return
+
+        *lines, self._stdin_buffer = (self._stdin_buffer + data).split(b"\n")
+        for line in lines:
+            self._commands.put_nowait(line.decode(errors="replace"))
+
+    # Next command line, or None once stdin is closed
+    async def _read_command(self) -> Optional[str]:
+        if self._commands is None:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(None, input, "> ")
+            except EOFError:
+                return None
+
+        print("> ", end="", flush=True)
+        return await self._commands.get()
+
     # Main loop
     async def run(self) -> None:
         await self._connect()
@@ -509,18 +690,24 @@ class MafiaGame:
 
         print("\nRoles distributed. Type 'next' to start the game.")
 
-        loop = asyncio.get_event_loop()
+        self._watch_stdin()
         running = True
 
         while running:
             try:
-                command = await loop.run_in_executor(None, input, "> ")
+                command = await self._read_command()
+                if command is None:
+                    break
                 running = await self._handle_command(command)
             except KeyboardInterrupt:
                 print("\nExiting...")
                 break
-            except EOFError:
-                break
+
+        if self._commands is not None:
+            asyncio.get_running_loop().remove_reader(sys.stdin.fileno())
+
+        if self._reader_task:
+            self._reader_task.cancel()
 
         if self.writer:
             self.writer.close()
@@ -24,6 +24,17 @@ void triggerSolenoid(int times) {
   }
 }
 
+void handleTap(JsonObject tap) {
+  int targetId = tap["id"];
+  int tapCount = tap["taps"];
+
+  if (targetId == DEVICE_ID) {
+    if (tapCount > 0 && tapCount <= 10) {
+      triggerSolenoid(tapCount);
+    }
+  }
+}
+
 bool connectToMQTT() {
   if (client.connect(mqtt_server, mqtt_port)) {
     connected = true;
@@ -32,7 +43,7 @@ bool connectToMQTT() {
     doc["topic"] = mqtt_topic;
     String json;
     serializeJson(doc, json);
-    client.print(json);
+    client.println(json);
     return true;
   } else {
     connected = false;
@@ -53,17 +64,17 @@ void checkForMessages() {
     if (!error) {
       if (doc.containsKey("payload")) {
         const char* payloadStr = doc["payload"];
-        StaticJsonDocument<256> payloadDoc;
+        StaticJsonDocument<512> payloadDoc;
         DeserializationError payloadError = deserializeJson(payloadDoc, payloadStr);
         
         if (!payloadError) {
-          int targetId = payloadDoc["id"];
-          int tapCount = payloadDoc["taps"];
-          
-          if (targetId == DEVICE_ID) {
-            if (tapCount > 0 && tapCount <= 10) {
-              triggerSolenoid(tapCount);
+          // Payload is either a single tap or a list of taps for several devices
+          if (payloadDoc.is<JsonArray>()) {
+            for (JsonObject tap : payloadDoc.as<JsonArray>()) {
+              handleTap(tap);
             }
+          } else {
+            handleTap(payloadDoc.as<JsonObject>());
           }
         }
       }